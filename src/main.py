@@ -1,11 +1,8 @@
 import os
-import zipfile
-import pydicom
+import argparse
 import logging
 
 from utils.dicom_anonimizer import IAnonimizer
-from utils.unzip_manager import UnzipManager
-from utils.dicom_anonimizer import Anonimizer
 from utils.utils_config import LOGS_PATH
 
 logging.basicConfig(
@@ -28,7 +25,25 @@ def anonimize_patients(anonimizer_i):
     """
     anonimizer_i.anonimize_patients()
 
+def parse_args():
+    """
+    Разобрать аргументы командной строки
+    """
+    parser = argparse.ArgumentParser(description='Распаковка и анонимизация dicom')
+    parser.add_argument(
+        'cmd',
+        nargs='?',
+        default='all',
+        choices=['unzip', 'anonimize', 'all'],
+        help='unzip - распаковать архивы и переименовать директории patient, '
+             'anonimize - анонимизировать dicom, all - всё по очереди (по умолчанию)',
+    )
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
     anonimizer = IAnonimizer()
-    unzip_patients(anonimizer)
-    anonimize_patients(anonimizer)
+    if args.cmd in ('unzip', 'all'):
+        unzip_patients(anonimizer)
+    if args.cmd in ('anonimize', 'all'):
+        anonimize_patients(anonimizer)
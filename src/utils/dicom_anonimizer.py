@@ -1,29 +1,90 @@
 import os
+import re
+import errno
 import pydicom
 import zipfile
-import shutil
 import logging
+import multiprocessing
 
-from pydicom.uid import generate_uid
+from io import BytesIO
+from pydicom.datadict import keyword_dict
+from concurrent.futures import ProcessPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
+from pydicom.uid import generate_uid, DeflatedExplicitVRLittleEndian
 from .utils_config import ZIPS_PATH, UNZIPED_PATH, PATTERNS_FOR_DICOM_ANONIMIZER, LOGS_PATH
 from .unzip_manager import UnzipManager
+from .dicom_walker import iter_dcm, iter_dcm_entries
 
 # logging.basicConfig(
 #     level=logging.INFO,
 #     filename=os.path.join(LOGS_PATH, 'dicom_anonimizer.log'),
 #     filemode='w',
 # )
-# logger = logging.getLogger(__name__)
+logger = logging.getLogger(__name__)
+
+# Все паттерны одним регулярным выражением: один проход по имени атрибута вместо поиска каждого паттерна
+_PATTERN_RE = re.compile('|'.join(map(re.escape, sorted(PATTERNS_FOR_DICOM_ANONIMIZER))), re.IGNORECASE)
+# Ключевые слова словаря DICOM, подпадающие под паттерны, считаются один раз при импорте
+_ANON_KEYWORDS = frozenset(keyword for keyword in keyword_dict if _PATTERN_RE.search(keyword))
+
+_PIXEL_DATA_VRS = (b'OB', b'OW', b'OF', b'OD')
+
+
+def _pixel_tail_matches(transfer_syntax, pixel_data):
+    """
+    Проверяет, что сырой хвост с PixelData закодирован так же, как save_as запишет заголовок
+    по заявленному transfer syntax. pydicom читает файлы с неверно заявленным transfer syntax,
+    определяя кодировку сам, и склейка такого хвоста с перезаписанным заголовком испортила бы файл.
+    """
+    if not pixel_data:
+        return True
+    if transfer_syntax is None:
+        return False
+    try:
+        is_little_endian = transfer_syntax.is_little_endian
+        is_implicit_vr = transfer_syntax.is_implicit_VR
+    except ValueError:
+        # Приватный или неизвестный transfer syntax: кодировку по UID не определить
+        return False
+    # Группа тега PixelData (7FE0) в начале хвоста выдаёт порядок байт
+    pixel_group = b'\xe0\x7f' if is_little_endian else b'\x7f\xe0'
+    has_explicit_vr = pixel_data[4:6] in _PIXEL_DATA_VRS
+    return pixel_data[:2] == pixel_group and has_explicit_vr != is_implicit_vr
+
+
+class AnonimizationError(RuntimeError):
+    """
+    Часть dicom не удалось анонимизировать: эти файлы остались на диске с исходными данными patient
+    """
+    def __init__(self, successes, failures):
+        super().__init__(f'Не удалось анонимизировать dicom: {failures} (успешно: {successes}), подробности в логе')
+        self.successes = successes
+        self.failures = failures
+
+
+def _init_worker_logging(log_queue, level):
+    """
+    Инициализатор процесса пула: все логи процесса уходят в очередь главного процесса.
+    Предупреждения pydicom идут через warnings, поэтому они тоже перенаправляются в logging.
+    """
+    root_logger = logging.getLogger()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    root_logger.setLevel(level)
+    logging.captureWarnings(True)
 
 class IAnonimizer:
+    """
+    Фасад над Anonimizer и UnzipManager. Методы возвращают self для цепочки вызовов,
+    кроме anonimize_patients: он возвращает (успешно, с ошибками)
+    """
     def __init__(self):
         self.anonimizer = Anonimizer()
 
     def anonimize_patients(self):
         """
-        Метод анонимизирует все dicom всех patient в директории UNZIPED_PATH
+        Метод анонимизирует все dicom всех patient в директории UNZIPED_PATH, возвращает (успешно, с ошибками)
         """
-        self.anonimizer.anonimize_all_patients()
+        return self.anonimizer.anonimize_all_patients()
 
     def unzip_all(self):
         """
@@ -43,60 +104,113 @@ class IAnonimizer:
 
 class Anonimizer:
     def anonimize_all_patients(self):
-        patients_folders = os.listdir(UNZIPED_PATH)
-        for patient_folder in patients_folders:
-            self.anonimize_patient(patient_folder)
-        return self
+        """
+        Анонимизирует всех patient, возвращает (успешно, с ошибками).
+        Если хотя бы один dicom не анонимизирован, после обработки остальных бросает AnonimizationError
+        """
+        patients_folders = []
+        root_dicom_entries = []
+        with os.scandir(UNZIPED_PATH) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    patients_folders.append(entry.name)
+                elif entry.name.lower().endswith('.dcm'):
+                    root_dicom_entries.append((entry.inode(), entry.path))
+        root_logger = logging.getLogger()
+        # Процессы не пишут в лог-файл сами: записи идут через очередь и выводятся одним QueueListener,
+        # так воркеры не конкурируют за файл и строки разных процессов не перемешиваются
+        log_queue = multiprocessing.Queue()
+        # Без настроенного logging записи из очереди выводятся в stderr, иначе ошибки воркеров потерялись бы
+        handlers = root_logger.handlers or [logging.StreamHandler()]
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        try:
+            # Разбор и запись заголовков pydicom идут на чистом Python под GIL, поэтому patient раскидываются по процессам
+            with ProcessPoolExecutor(initializer=_init_worker_logging, initargs=(log_queue, root_logger.level)) as executor:
+                results = list(executor.map(self.anonimize_patient, patients_folders))
+        finally:
+            listener.stop()
+        # dicom прямо в UNZIPED_PATH не принадлежат ни одной директории patient, их анонимизирует главный процесс
+        results.append(self.anonimize_dicoms(path for _, path in sorted(root_dicom_entries)))
+        successes = sum(patient_successes for patient_successes, _ in results)
+        failures = sum(patient_failures for _, patient_failures in results)
+        if failures:
+            logger.error(f'Анонимизировано dicom: {successes}, с ошибками: {failures}')
+            raise AnonimizationError(successes, failures)
+        logger.info(f'Анонимизировано dicom: {successes}, с ошибками: {failures}')
+        return successes, failures
 
     def anonimize_patient(self, patient_folder):
-        for root, dirs, files in os.walk(top=UNZIPED_PATH):
-            for file in files:
-                if file.endswith('.dcm'):
-                    current_dicom_path = os.path.join(root, file)
-                    current_dicom_data = pydicom.dcmread(current_dicom_path)
-                    attrs_to_anon = [x for x in dir(current_dicom_data) if any(pattern in x.lower() for pattern in PATTERNS_FOR_DICOM_ANONIMIZER)]
-                    for attr in attrs_to_anon:
-                        setattr(current_dicom_data, attr, '')
-                    current_dicom_data.save_as(current_dicom_path)
+        """
+        Анонимизирует все dicom одного patient, возвращает (успешно, с ошибками)
+        """
+        # Порядок inode на ext4/XFS близок к физическому порядку на диске: меньше случайных seek, лучше readahead
+        dicom_entries = sorted((entry.inode(), entry.path) for entry in iter_dcm_entries(os.path.join(UNZIPED_PATH, patient_folder)))
+        return self.anonimize_dicoms(path for _, path in dicom_entries)
+
+    def anonimize_dicoms(self, dicom_paths):
+        """
+        Анонимизирует переданные dicom, возвращает (успешно, с ошибками)
+        """
+        successes = 0
+        failures = 0
+        for current_dicom_path in dicom_paths:
+            try:
+                self.anonimize_dicom(current_dicom_path)
+                successes += 1
+            except Exception:
+                logger.exception(f'Не удалось анонимизировать {current_dicom_path}')
+                failures += 1
+        return successes, failures
+
+    def anonimize_dicom(self, dicom_path):
+        """
+        Анонимизирует один dicom. Читается только заголовок до PixelData,
+        пиксельные данные дописываются обратно в файл байт в байт, без декодирования.
+        """
+        with open(dicom_path, 'rb') as dicom_file:
+            current_dicom_data = pydicom.dcmread(dicom_file, stop_before_pixels=True)
+            pixel_data = dicom_file.read()
+        transfer_syntax = current_dicom_data.file_meta.get('TransferSyntaxUID')
+        # deflate сжимает весь датасет целиком, хвост с PixelData по смещению не отделить;
+        # хвост в другой кодировке, чем заявлена в заголовке, тоже нельзя дописывать как есть
+        if transfer_syntax == DeflatedExplicitVRLittleEndian or not _pixel_tail_matches(transfer_syntax, pixel_data):
+            current_dicom_data = pydicom.dcmread(dicom_path)
+            pixel_data = b''
+        # Уже пустые элементы пропускаются: повторное присваивание '' создаёт DataElement и проверяет VR впустую
+        attrs_to_anon = [elem.keyword for elem in current_dicom_data if elem.keyword in _ANON_KEYWORDS and not elem.is_empty]
+        if not attrs_to_anon:
+            # Менять нечего - файл не перезаписывается
+            return self
+        for attr in attrs_to_anon:
+            setattr(current_dicom_data, attr, '')
+        header = BytesIO()
+        current_dicom_data.save_as(header)
+        with open(dicom_path, 'wb') as dicom_file:
+            dicom_file.write(header.getvalue())
+            dicom_file.write(pixel_data)
         return self
 
     def anonimize_folders(self):
         folders = [x for x in os.listdir(UNZIPED_PATH)]
         patient_folders = [f'patient__{x}' for x in range(1, len(folders) + 1)]
         for x, y in zip(folders, patient_folders):
-            for root, dirs, files in os.walk(top=UNZIPED_PATH):
-                for file in files:
-                    if file.endswith('.dcm'):
-                        current_dicom_path = os.path.join(root, file)
-                        current_dicom_data = pydicom.dcmread(current_dicom_path)
-                        sex_attribute_found = False
-                        age_attribute_found = False
-                        for attr in dir(current_dicom_data):
-                            if 'Sex' in attr:
-                                if getattr(current_dicom_data, attr) != '':
-                                    sex_attribute_found = True
-                                    sex_attribute = getattr(current_dicom_data, attr)
-                                    # logger.info(sex_attribute)
-                                    # logger.info(type(sex_attribute))
-                                    # logger.info(len(sex_attribute))
-                            if attr.endswith('Age') or attr.startswith('Age'):
-                                if getattr(current_dicom_data, attr) != '':
-                                    age_attribute_found = True
-                                    age_attribute = getattr(current_dicom_data, attr)
-                                    # logger.info(attr)
-                                    # logger.info(type(age_attribute))
-                                    # logger.info(len(age_attribute))
-                                    # logger.info(f'_{age_attribute}_')
-                        if not sex_attribute_found:
-                            sex_attribute = 'NO_SEX'
-                        if not age_attribute_found:
-                            age_attribute = 'NO_AGE'
-            folder_name = f"{y}_{sex_attribute}_{age_attribute}"
             folder = os.path.join(UNZIPED_PATH, x)
+            sex_attribute, age_attribute = self.get_sex_and_age_from_dicom(folder)
+            folder_name = f"{y}_{sex_attribute}_{age_attribute}"
             pat_folder = os.path.join(UNZIPED_PATH, folder_name)
-            os.mkdir(pat_folder)
-            for inner_folder in os.listdir(folder):
-                source_path = os.path.join(folder, inner_folder)
-                destination_path = os.path.join(pat_folder, inner_folder)
-                shutil.move(source_path, destination_path)
-            os.rmdir(folder)
+            # Обе директории лежат в UNZIPED_PATH, т.е. на одной файловой системе - достаточно одного rename.
+            # rename молча заменил бы пустую директорию, поэтому существующая проверяется явно, как раньше в os.mkdir
+            if os.path.exists(pat_folder):
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), pat_folder)
+            os.rename(folder, pat_folder)
+
+    def get_sex_and_age_from_dicom(self, folder_path):
+        """
+        Возвращает пол и возраст patient по первому dicom в его директории
+        """
+        dicom_path = next(iter_dcm(folder_path), None)
+        if dicom_path is None:
+            return 'NO_SEX', 'NO_AGE'
+        dicom_data = pydicom.dcmread(dicom_path, specific_tags=['PatientSex', 'PatientAge'], stop_before_pixels=True)
+        return dicom_data.get('PatientSex') or 'NO_SEX', dicom_data.get('PatientAge') or 'NO_AGE'
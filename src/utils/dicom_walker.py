@@ -0,0 +1,42 @@
+import os
+
+
+def iter_dcm_entries(root):
+    """
+    Рекурсивно обходит root через os.scandir и отдаёт DirEntry всех .dcm файлов.
+    DirEntry уже знает тип записи и inode, поэтому лишних stat на каждый файл не делается.
+    """
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from iter_dcm_entries(entry.path)
+            elif entry.name.lower().endswith('.dcm'):
+                yield entry
+
+
+def iter_dcm(root):
+    """
+    Отдаёт пути ко всем .dcm файлам внутри root.
+    """
+    for entry in iter_dcm_entries(root):
+        yield entry.path
+
+
+def iter_dcm_folders(root):
+    """
+    Отдаёт директории внутри root, в которых есть хотя бы один .dcm файл.
+    После первого .dcm имена остальных файлов директории уже не проверяются,
+    просмотр продолжается только ради поддиректорий.
+    """
+    folders = [root]
+    while folders:
+        folder = folders.pop()
+        has_dicom = False
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif not has_dicom and entry.name[-4:].lower() == '.dcm':
+                    has_dicom = True
+        if has_dicom:
+            yield folder
@@ -1,6 +1,14 @@
 import zipfile
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+from .dicom_walker import iter_dcm_folders
+
+# Каждая часть заново разбирает central directory архива на чистом Python под GIL,
+# поэтому частей на архив немного и в каждой достаточно сжатых данных, чтобы окупить разбор
+_MAX_PARTS_PER_ZIP = 8
+_MIN_PART_BYTES = 64 * 1024 * 1024
+
 
 class UnzipManager:
 
@@ -15,13 +23,51 @@ class UnzipManager:
     def __enter__(self):
         """
         Метод вызывается при входе в контекст. Открываем все зипы в директории и распаковываем их.
+        Inflate в zlib отпускает GIL, поэтому архивы распаковываются параллельно.
+        Если архивов меньше, чем потоков, каждый архив делится на части по файлам, чтобы был занят каждый поток.
         """
         self.zip_files = [os.path.join(self.zip_dir, f) for f in os.listdir(self.zip_dir) if f.lower().endswith('.zip')]
+        # process_cpu_count (Python 3.13+) учитывает привязку процесса к ядрам, cpu_count - все ядра машины
+        max_workers = getattr(os, 'process_cpu_count', os.cpu_count)() or 1
+        parts_per_zip = min(-(-max_workers // len(self.zip_files)), _MAX_PARTS_PER_ZIP) if self.zip_files else 1
+        shards = []
         for zip_file_path in self.zip_files:
-            with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-                zip_ref.extractall(self.extract_path)
+            shards.extend(self._split_archive(zip_file_path, parts_per_zip))
+        with ThreadPoolExecutor(max_workers=min(len(shards), max_workers) or 1) as executor:
+            list(executor.map(self._extract_shard, shards))
         return self
 
+    def _split_archive(self, zip_file_path, parts):
+        """
+        Делит архив на parts частей подряд идущих файлов, но не мельче _MIN_PART_BYTES сжатых данных на часть.
+        Возвращает список (путь к архиву, файлы части), None вместо списка файлов означает весь архив.
+        """
+        if parts == 1:
+            return [(zip_file_path, None)]
+        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+            members = zip_ref.infolist()
+        compressed_size = sum(member.compress_size for member in members)
+        parts = min(parts, -(-compressed_size // _MIN_PART_BYTES))
+        if parts <= 1:
+            return [(zip_file_path, None)]
+        part_size = -(-len(members) // parts) or 1
+        return [(zip_file_path, members[i:i + part_size]) for i in range(0, len(members), part_size)]
+
+    def _extract_shard(self, shard):
+        """
+        Распаковывает часть архива в extract_path. Каждая часть открывает свой ZipFile,
+        чтобы потоки не делили между собой одну позицию чтения файла.
+        zipfile создаёт директории через os.makedirs без exist_ok, и две части с общей директорией
+        могут создать её одновременно, поэтому на FileExistsError извлечение повторяется один раз.
+        """
+        zip_file_path, members = shard
+        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+            for member in zip_ref.infolist() if members is None else members:
+                try:
+                    zip_ref.extract(member, self.extract_path)
+                except FileExistsError:
+                    zip_ref.extract(member, self.extract_path)
+
     def __exit__(self, exc_type, exc_value, traceback):
         """
         Метод вызывается при закрытии контекста.
@@ -33,9 +79,4 @@ class UnzipManager:
         Возвращает список директорий, где хранятся DICOM файлы.
         Ищем DICOM файлы по расширению .dcm.
         """
-        dicom_folders = set()
-        for root, dirs, files in os.walk(self.extract_path):
-            for file in files:
-                if file.lower().endswith('.dcm'):
-                    dicom_folders.add(root)
-        return list(dicom_folders)
+        return list(iter_dcm_folders(self.extract_path))
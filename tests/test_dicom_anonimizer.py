@@ -0,0 +1,135 @@
+import shutil
+import logging
+import pydicom
+import pytest
+
+from pathlib import Path
+from pydicom.data import get_testdata_file
+from utils.dicom_anonimizer import Anonimizer, AnonimizationError
+
+
+def _write_mismatched_transfer_syntax(path):
+    """
+    MR_small.dcm закодирован explicit VR, но в заголовке заявлен implicit VR transfer syntax
+    """
+    data = Path(get_testdata_file('MR_small.dcm')).read_bytes()
+    explicit_uid = b'1.2.840.10008.1.2.1\x00'
+    data = data.replace(explicit_uid, b'1.2.840.10008.1.2\x00\x00\x00', 1)
+    path.write_bytes(data)
+
+
+def _write_private_transfer_syntax(path):
+    """
+    CT_small.dcm с приватным transfer syntax, pydicom читает его как explicit VR little endian
+    """
+    data = Path(get_testdata_file('CT_small.dcm')).read_bytes()
+    explicit_uid = b'1.2.840.10008.1.2.1\x00'
+    data = data.replace(explicit_uid, b'1.2.3.4.5.6.7.8.9.10', 1)
+    path.write_bytes(data)
+
+
+@pytest.fixture(params=['MR_small.dcm', 'MR_small_implicit.dcm', 'MR_small_bigendian.dcm', 'image_dfl.dcm', 'mismatched', 'private'])
+def dicom_path(request, tmp_path):
+    path = tmp_path / 'image.dcm'
+    if request.param == 'mismatched':
+        _write_mismatched_transfer_syntax(path)
+    elif request.param == 'private':
+        _write_private_transfer_syntax(path)
+    else:
+        shutil.copy(get_testdata_file(request.param), path)
+    return str(path)
+
+
+def test_anonimize_dicom_keeps_pixel_data(dicom_path):
+    original = pydicom.dcmread(dicom_path)
+    assert original.PatientName
+
+    Anonimizer().anonimize_dicom(dicom_path)
+
+    anonimized = pydicom.dcmread(dicom_path)
+    assert anonimized.PixelData == original.PixelData
+    assert anonimized.file_meta.TransferSyntaxUID == original.file_meta.TransferSyntaxUID
+    assert not anonimized.PatientName
+    assert not anonimized.get('StudyDate')
+
+
+def test_anonimize_dicom_skips_anonimized_file(dicom_path):
+    Anonimizer().anonimize_dicom(dicom_path)
+    anonimized = Path(dicom_path).read_bytes()
+
+    Anonimizer().anonimize_dicom(dicom_path)
+
+    assert Path(dicom_path).read_bytes() == anonimized
+
+
+def test_anonimize_patient_counts_failures(tmp_path, monkeypatch):
+    patient_path = tmp_path / 'patient'
+    patient_path.mkdir()
+    shutil.copy(get_testdata_file('MR_small.dcm'), patient_path / 'good.dcm')
+    (patient_path / 'bad.dcm').write_bytes(b'not a dicom')
+    monkeypatch.setattr('utils.dicom_anonimizer.UNZIPED_PATH', str(tmp_path))
+
+    assert Anonimizer().anonimize_patient('patient') == (1, 1)
+
+
+@pytest.fixture
+def unziped_path(tmp_path, monkeypatch):
+    """
+    UNZIPED_PATH во временной директории. Переменная окружения нужна процессам пула,
+    запущенным через spawn/forkserver: они заново импортируют utils_config
+    """
+    monkeypatch.setattr('utils.dicom_anonimizer.UNZIPED_PATH', str(tmp_path))
+    monkeypatch.setenv('UNZIPED_PATH', str(tmp_path))
+    return tmp_path
+
+
+def test_anonimize_all_patients_anonimizes_root_dicom(unziped_path):
+    patient_path = unziped_path / 'patient'
+    patient_path.mkdir()
+    shutil.copy(get_testdata_file('MR_small.dcm'), patient_path / 'image.dcm')
+    shutil.copy(get_testdata_file('CT_small.dcm'), unziped_path / 'root.dcm')
+
+    assert Anonimizer().anonimize_all_patients() == (2, 0)
+    assert not pydicom.dcmread(unziped_path / 'root.dcm').PatientName
+
+
+def test_anonimize_all_patients_raises_on_failures(unziped_path):
+    for patient in ('first', 'second'):
+        (unziped_path / patient).mkdir()
+        shutil.copy(get_testdata_file('MR_small.dcm'), unziped_path / patient / 'image.dcm')
+    (unziped_path / 'second' / 'bad.dcm').write_bytes(b'not a dicom')
+
+    with pytest.raises(AnonimizationError) as error:
+        Anonimizer().anonimize_all_patients()
+
+    assert (error.value.successes, error.value.failures) == (2, 1)
+    assert not pydicom.dcmread(unziped_path / 'first' / 'image.dcm').PatientName
+
+
+@pytest.fixture
+def corrupt_patient(unziped_path):
+    (unziped_path / 'patient').mkdir()
+    (unziped_path / 'patient' / 'bad.dcm').write_bytes(b'not a dicom')
+    return unziped_path / 'patient' / 'bad.dcm'
+
+
+def test_anonimize_all_patients_logs_worker_errors_to_root_handlers(corrupt_patient, caplog):
+    caplog.set_level(logging.INFO)
+
+    with pytest.raises(AnonimizationError):
+        Anonimizer().anonimize_all_patients()
+
+    worker_errors = [record.getMessage() for record in caplog.records if str(corrupt_patient) in record.getMessage()]
+    assert len(worker_errors) == 1
+    assert 'InvalidDicomError' in worker_errors[0]
+
+
+def test_anonimize_all_patients_logs_worker_errors_to_stderr_without_handlers(corrupt_patient, monkeypatch, capfd):
+    monkeypatch.setattr(logging.getLogger(), 'handlers', [])
+
+    with pytest.raises(AnonimizationError):
+        Anonimizer().anonimize_all_patients()
+
+    stderr = capfd.readouterr().err
+    assert f'Не удалось анонимизировать {corrupt_patient}' in stderr
+    assert 'InvalidDicomError' in stderr
@@ -0,0 +1,71 @@
+import os
+import zipfile
+import pytest
+
+from utils.unzip_manager import UnzipManager
+
+
+@pytest.fixture
+def zip_dir(tmp_path):
+    """
+    Архив, в котором все файлы лежат в общем дереве директорий: части архива создают его одновременно
+    """
+    zip_dir = tmp_path / 'zips'
+    zip_dir.mkdir()
+    with zipfile.ZipFile(zip_dir / 'patient.zip', 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        zip_ref.writestr('patient/', '')
+        for i in range(200):
+            zip_ref.writestr(f'patient/series_{i % 4}/sub_{i % 3}/image_{i}.dcm', os.urandom(64))
+    return zip_dir
+
+
+def test_unzip_manager_extracts_all_members_in_parts(zip_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr('utils.unzip_manager._MIN_PART_BYTES', 1)
+    monkeypatch.setattr(os, 'process_cpu_count', lambda: 64, raising=False)
+    shards = []
+    extract_shard = UnzipManager._extract_shard
+
+    def record_shard(manager, shard):
+        shards.append(shard)
+        extract_shard(manager, shard)
+
+    monkeypatch.setattr(UnzipManager, '_extract_shard', record_shard)
+    extract_path = tmp_path / 'unziped'
+
+    with UnzipManager(str(zip_dir), str(extract_path)) as manager:
+        dicom_dirs = manager.get_folder()
+
+    assert len(shards) == 8
+    with zipfile.ZipFile(zip_dir / 'patient.zip') as zip_ref:
+        for member in zip_ref.infolist():
+            extracted = extract_path / member.filename
+            assert extracted.is_dir() if member.is_dir() else extracted.read_bytes() == zip_ref.read(member)
+    assert len(dicom_dirs) == 12
+
+
+def test_unzip_manager_keeps_small_archive_whole(zip_dir, tmp_path):
+    zip_file_path = str(zip_dir / 'patient.zip')
+
+    assert UnzipManager(str(zip_dir), str(tmp_path))._split_archive(zip_file_path, 8) == [(zip_file_path, None)]
+
+
+def test_extract_shard_retries_on_file_exists(zip_dir, tmp_path, monkeypatch):
+    extract = zipfile.ZipFile.extract
+    raised = []
+
+    def extract_after_race(zip_ref, member, path=None, pwd=None):
+        # Первое извлечение падает так же, как os.makedirs, когда директорию успела создать другая часть
+        if not raised:
+            raised.append(member)
+            raise FileExistsError(member)
+        return extract(zip_ref, member, path, pwd)
+
+    monkeypatch.setattr(zipfile.ZipFile, 'extract', extract_after_race)
+    extract_path = tmp_path / 'unziped'
+    zip_file_path = str(zip_dir / 'patient.zip')
+
+    UnzipManager(str(zip_dir), str(extract_path))._extract_shard((zip_file_path, None))
+
+    assert raised
+    with zipfile.ZipFile(zip_file_path) as zip_ref:
+        assert all((extract_path / name).exists() for name in zip_ref.namelist())